@@ -1,4 +1,6 @@
+import atexit
 import sqlite3
+import threading
 from contextlib import contextmanager
 from pathlib import Path
 
@@ -22,21 +24,74 @@ CREATE TABLE IF NOT EXISTS users (
 );
 """
 
+# Columnas de usuario en el orden en que se devuelven los dicts
+_SQL_SELECT_USERS = """
+    SELECT id, nombre, apellido, apodo, edad, peso, device_id, sexo,
+           hr_rest, hr_max, is_sim, dob, hr_max_auto
+    FROM users
+"""
+_SQL_LIST_USERS = _SQL_SELECT_USERS + "ORDER BY id DESC"
+_SQL_USER_BY_ID = _SQL_SELECT_USERS + "WHERE id=?"
+_SQL_USER_BY_DEVICE = _SQL_SELECT_USERS + "WHERE device_id=?"
+
 IDX = """
 CREATE INDEX IF NOT EXISTS idx_users_is_sim ON users(is_sim);
 """
 
+# Una sola conexión persistente para todo el proceso: abrir SQLite en cada
+# llamada cuesta más que la propia consulta, y la caché de páginas sobrevive.
+# Flask (threaded=True) crea un hilo por petición, así que una conexión por
+# hilo duraría una petición; el RLock serializa el uso (como en session_manager).
+_CONN = None
+_CONN_LOCK = threading.RLock()
+
+# PRAGMAs al abrir cada conexión. WAL queda guardado en el fichero; con WAL,
+# synchronous=NORMAL solo sincroniza en los checkpoints, no en cada commit.
+_BUSY_TIMEOUT_MS = 5000
+
+def _configure(conn: sqlite3.Connection):
+    conn.row_factory = sqlite3.Row  # row_to_dict -> dict(r), sin indexar a mano
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={_BUSY_TIMEOUT_MS}")
+
+# El esquema se comprueba una vez por proceso, no en cada CRUD
+_SCHEMA_READY = False
+_SCHEMA_LOCK = threading.Lock()
+
+def _shared_conn():
+    global _CONN
+    if _CONN is None:
+        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        _configure(conn)
+        atexit.register(conn.close)
+        _CONN = conn
+    return _CONN
+
 @contextmanager
 def get_conn():
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        yield conn
-    finally:
-        conn.close()
+    """Presta la conexión compartida bajo _CONN_LOCK (no se cierra; se deshace lo no confirmado)."""
+    with _CONN_LOCK:
+        conn = _shared_conn()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
 
 def _ensure_schema():
     """Crea la tabla y aplica migraciones suaves (añadir columnas/índices si faltan)."""
+    global _SCHEMA_READY
+    if _SCHEMA_READY:
+        return
+    with _SCHEMA_LOCK:
+        if _SCHEMA_READY:
+            return
+        _migrate()
+        _SCHEMA_READY = True
+
+def _migrate():
     with get_conn() as conn:
         conn.execute(SCHEMA)
         cols = {r[1] for r in conn.execute("PRAGMA table_info(users)").fetchall()}
@@ -96,25 +151,15 @@ def list_users():
     _ensure_schema()
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("""
-            SELECT id, nombre, apellido, apodo, edad, peso, device_id, sexo,
-                   hr_rest, hr_max, is_sim, dob, hr_max_auto
-            FROM users
-            ORDER BY id DESC
-        """)
+        cur.execute(_SQL_LIST_USERS)
         rows = cur.fetchall()
-        return [row_to_dict(r) for r in rows]
+        return list(map(dict, rows))
 
 def get_user(user_id):
     _ensure_schema()
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("""
-            SELECT id, nombre, apellido, apodo, edad, peso, device_id, sexo,
-                   hr_rest, hr_max, is_sim, dob, hr_max_auto
-            FROM users
-            WHERE id=?
-        """, (user_id,))
+        cur.execute(_SQL_USER_BY_ID, (user_id,))
         row = cur.fetchone()
         return row_to_dict(row) if row else None
 
@@ -122,12 +167,7 @@ def get_user_by_device(device_id: int):
     _ensure_schema()
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("""
-            SELECT id, nombre, apellido, apodo, edad, peso, device_id, sexo,
-                   hr_rest, hr_max, is_sim, dob, hr_max_auto
-            FROM users
-            WHERE device_id=?
-        """, (device_id,))
+        cur.execute(_SQL_USER_BY_DEVICE, (device_id,))
         row = cur.fetchone()
         return row_to_dict(row) if row else None
 
@@ -161,18 +201,4 @@ def update_user(user_id, **fields):
 # -------------------------------------------------------
 
 def row_to_dict(r):
-    return {
-        "id":          r[0],
-        "nombre":      r[1],
-        "apellido":    r[2],
-        "apodo":       r[3],
-        "edad":        r[4],
-        "peso":        r[5],
-        "device_id":   r[6],
-        "sexo":        r[7],
-        "hr_rest":     r[8],
-        "hr_max":      r[9],
-        "is_sim":      r[10],
-        "dob":         r[11],
-        "hr_max_auto": r[12],
-    }
+    return dict(r)
@@ -43,20 +43,59 @@ app.config["JSONIFY_PRETTYPRINT_REGULAR"] = False
 
 # ===== Filtros Jinja / utilidades edad & Tanaka =====
 from datetime import date, datetime
+from functools import lru_cache
+
+@lru_cache(maxsize=4096)
+def _age_from_dob_cached(dob_str, today_ord):
+    """Edad para (dob, hoy); al renderizar listas de usuarios se repite mucho."""
+    y, m, d = dob_str[0:4], dob_str[5:7], dob_str[8:10]
+    # YYYY-MM-DD por posiciones fijas (sin split ni excepciones)
+    if not (len(dob_str) == 10 and dob_str[4] == '-' and dob_str[7] == '-'
+            and y.isdecimal() and m.isdecimal() and d.isdecimal()):
+        # resto de formatos: los mismos que aceptaba int() (espacios, signo '+'...)
+        parts = dob_str.split('-')
+        if len(parts) != 3:
+            return None
+        try:
+            y, m, d = map(int, parts)
+        except ValueError:
+            return None
+    try:
+        dob = date(int(y), int(m), int(d))
+    except (ValueError, OverflowError):  # fecha imposible (mes 13, 30 de febrero, año enorme...)
+        return None
+    today = date.fromordinal(today_ord)
+    age = today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
+    return max(0, age)
+
+# (epoch de la próxima medianoche local, ordinal de hoy): date.today() solo al cambiar de día
+_TODAY = (0.0, 0)
+
+def _today_ord() -> int:
+    global _TODAY
+    until, today_ord = _TODAY
+    if time.time() >= until:
+        today = date.today()
+        today_ord = today.toordinal()
+        until = time.mktime((today.year, today.month, today.day + 1, 0, 0, 0, -1, -1, -1))
+        _TODAY = (until, today_ord)
+    return today_ord
 
 def age_from_dob(dob_str):
-    if not dob_str:
+    # solo cadenas (date, números... -> None, como antes); la caché exige hashable
+    if not isinstance(dob_str, str):
         return None
-    try:
-        y, m, d = map(int, dob_str.split('-'))
-        dob = date(y, m, d)
-        today = date.today()
-        age = today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
-        return max(0, age)
-    except Exception:
+    dob_str = dob_str.strip()
+    if not dob_str:
         return None
+    return _age_from_dob_cached(dob_str, _today_ord())
 
 def tanaka_from_age(age):
+    # caso normal (int de age_from_dob / DB): sin try ni int()
+    if age.__class__ is int:
+        return int(round(208 - 0.7 * age)) if age > 0 else None
+    if age is None:
+        return None
     try:
         e = int(age)
         if e > 0:
@@ -85,7 +124,7 @@ DEVICE_RECENT_SECS = float(os.getenv("HRM_DEVICE_RECENT_SECS", "45"))
 
 # --- Estado en memoria ---
 STATE = {}                   # {dev_id: {"hr": int, "ts": iso}}
-SESSION = metrics.SessionStore()
+SESSION = metrics.ShardedSessionStore()
 
 # --- Throttling/caché para /live ---
 _LIVE_CACHE = {"ts": 0.0, "key": None, "payload": None}
@@ -99,9 +138,10 @@ _USER_CACHE_TS = 0.0
 METRICS_CACHE = {}
 
 # ==================== UTILIDADES ====================
-def _refresh_user_cache_if_needed():
+def _refresh_user_cache_if_needed(now: float | None = None):
     global _USER_CACHE_TS
-    now = time.time()
+    if now is None:
+        now = time.time()
     if now - _USER_CACHE_TS > USER_CACHE_TTL:
         _USER_CACHE_TS = now
 
@@ -131,15 +171,6 @@ def _state_signature(limit: int) -> str:
     items = items[:max(1, min(256, limit))]
     return ','.join(f'{dev}|{v.get("hr")}|{v.get("ts")}' for dev, v in items)
 
-def _parse_ts(ts_iso: str | None):
-    from datetime import datetime, timezone
-    if not ts_iso:
-        return None
-    try:
-        return datetime.fromisoformat(ts_iso.replace("Z", "+00:00")).astimezone(timezone.utc)
-    except Exception:
-        return None
-
 # ======================= DEMO SLOTS (solo en memoria) =======================
 DEMO_SLOTS = [
     ("DEMO 1", 36466), ("DEMO 2", 91002), ("DEMO 3", 91003), ("DEMO 4", 91004), ("DEMO 5", 91005),
@@ -224,7 +255,7 @@ def live():
         if recently or same:
             return jsonify(_LIVE_CACHE["payload"])
 
-    _refresh_user_cache_if_needed()
+    _refresh_user_cache_if_needed(now)  # mismo reloj que el resto de la petición
     entries = []
     for dev, val in list(STATE.items())[:256]:
         hr = val.get("hr")
@@ -258,15 +289,15 @@ def api_unassigned_devices():
     except Exception:
         recent = DEVICE_RECENT_SECS
 
-    now = time.time()
+    # edades en ms enteros: un solo 'now' y una resta por dispositivo
+    max_age_ms = recent * 1000.0
+    now_ms = int(time.time() * 1000)
     out = []
     for dev, val in STATE.items():
         ts_iso = val.get("ts")
-        ts = _parse_ts(ts_iso)
-        if ts:
-            age_s = now - ts.timestamp()
-            if age_s > recent:
-                continue
+        ts_ms = metrics.parse_ts_ms(ts_iso)
+        if ts_ms is not None and now_ms - ts_ms > max_age_ms:
+            continue
         if db.get_user_by_device(dev) is None:
             out.append({"dev": int(dev), "hr": val.get("hr"), "ts": ts_iso})
     out.sort(key=lambda d: d["dev"])
@@ -537,6 +568,12 @@ def api_oneoff_delete(ymd):
     sm.SESSION.delete_oneoff(ymd)
     return jsonify({'ok': True})
 
+# ==================== SNAPSHOT (carga inicial de /sessions) ====================
+@app.route('/session/snapshot', methods=["GET"])
+def api_session_snapshot():
+    """Clases, calendario, one-offs y clase por defecto en una sola petición."""
+    return jsonify(sm.SESSION.bulk_snapshot())
+
 # ==================== VISTAS ====================
 @app.route("/sessions")
 def sessions_ui():
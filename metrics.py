@@ -1,6 +1,12 @@
-from datetime import datetime, timezone
+import sys
+import threading
+from bisect import bisect_right
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
 from typing import Optional, Tuple
 
+import numpy as np
+
 # ==================== PARÁMETROS ====================
 # Zonas por %HRR (Karvonen)
 HRR_Z1 = 0.50  # <50% HRR
@@ -28,18 +34,49 @@ MIXED_ADJ_Z4 = 1.10
 MIXED_ADJ_REC_HRR = 0.90  # <50% HRR
 MIXED_ADJ_REC_HMX = 0.90  # <60% HRmax
 STRENGTH_ADJ = 1.30
+
+# Sesiones indexadas por dev_id: ANT+ usa números de dispositivo de 16 bits,
+# así que por debajo de este límite se guardan en una lista densa.
+DENSE_MAX_DEV_ID = 0xFFFF
+
+# Tabla por sesión de (zona, kcal/min, puntos/min) para cada HR entero 0..255
+HR_LUT_SIZE = 256
 # ====================================================
 
 
+def _round3(x: float) -> float:
+    """Redondeo a 3 decimales por escalado entero (más barato que round(x, 3))."""
+    return int(x * 1000.0 + (0.5 if x >= 0.0 else -0.5)) / 1000.0
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_ONE_MS = timedelta(milliseconds=1)
+_INV_60000 = 1.0 / 60000.0  # ms -> min
+
+
+# Desde 3.11 fromisoformat ya acepta el sufijo 'Z'
+_FROMISO_Z = sys.version_info >= (3, 11)
+
+
 def _parse_ts(ts_iso: str | None):
     if not ts_iso:
         return None
     try:
-        return datetime.fromisoformat(ts_iso.replace("Z", "+00:00")).astimezone(timezone.utc)
+        ts = datetime.fromisoformat(ts_iso if _FROMISO_Z else ts_iso.replace("Z", "+00:00"))
+        # hr_real ya emite UTC ('+00:00' -> timezone.utc): convertir solo si hace falta
+        return ts if ts.tzinfo is timezone.utc else ts.astimezone(timezone.utc)
     except Exception:
         return None
 
 
+def parse_ts_ms(ts_iso: str | None) -> Optional[int]:
+    """Epoch UTC en milisegundos enteros (None si no se puede parsear)."""
+    ts = _parse_ts(ts_iso)
+    if ts is None:
+        return None
+    return (ts - _EPOCH) // _ONE_MS
+
+
 # -------------------- HRmax --------------------
 def hrmax_estimada(edad: int | None) -> int:
     """Tanaka (2001): HRmax ≈ 208 - 0.7*edad."""
@@ -69,51 +106,97 @@ def pick_method(user: Optional[dict]) -> Tuple[str, Optional[int]]:
     return "hrmax", None
 
 
+# Método como entero para las rutas internas: índice en tablas por método en
+# lugar de comparar strings en cada muestra. La API pública sigue con "hrr"/"hrmax".
+METHOD_HRR, METHOD_HMX = 0, 1
+
+def method_id(method: str) -> int:
+    return METHOD_HRR if method == "hrr" else METHOD_HMX
+
+
 # -------------------- Fracciones de intensidad --------------------
+def _clamp01(x: float) -> float:
+    # comparaciones directas: más barato que max(0.0, min(1.0, x))
+    return 0.0 if x < 0.0 else (1.0 if x > 1.0 else x)
+
 def frac_hrr(hr: Optional[int], hr_max: int, hr_rest: int) -> float:
     """%HRR en [0..1]."""
     if hr is None or hr_max <= 0:
         return 0.0
-    hrr = max(1, hr_max - hr_rest)
-    return max(0.0, min(1.0, (hr - hr_rest) / hrr))
+    hrr = hr_max - hr_rest
+    if hrr < 1:
+        hrr = 1
+    return _clamp01((hr - hr_rest) / hrr)
 
 def frac_hrmax(hr: Optional[int], hr_max: int) -> float:
     """%HRmax en [0..1]."""
     if hr is None or hr_max <= 0:
         return 0.0
-    return max(0.0, min(1.0, hr / float(hr_max)))
+    return _clamp01(hr / float(hr_max))
 
 
 # -------------------- Zonas --------------------
+# Zona como entero 1..5; índice 0 cae en "Z1" por seguridad.
+_ZONE_STRS = ("Z1", "Z1", "Z2", "Z3", "Z4", "Z5")
+
+def _int_to_zone(i: int) -> str:
+    return _ZONE_STRS[i] if 1 <= i <= 5 else "Z1"
+
+def _zone_to_int(z: str | None) -> int:
+    # "Z1".."Z5" -> 1..5 leyendo el dígito directamente (sin dict por llamada)
+    return ord(z[1]) - 48 if z and len(z) == 2 and "1" <= z[1] <= "5" else 1
+
+# Bordes inferiores de Z2..Z5 por método (HRR: Z4 cubre 70–89%, por eso salta a HRR_Z5)
+_HRR_T = (HRR_Z1, HRR_Z2, HRR_Z3, HRR_Z5)
+_HMX_T = (HMX_Z1, HMX_Z2, HMX_Z3, HMX_Z4)
+_ZONE_EDGES_BY_METHOD = (_HRR_T, _HMX_T)  # índice = method_id
+
+def _zone_int_by_method_id(frac: float, mid: int) -> int:
+    # búsqueda binaria en C sobre los bordes: sin escalera de if/elif
+    return 1 + bisect_right(_ZONE_EDGES_BY_METHOD[mid], frac)
+
+def _zone_int_from_frac(frac: float, method: str) -> int:
+    return _zone_int_by_method_id(frac, method_id(method))
+
 def zone_code_from_frac(frac: float, method: str) -> str:
-    if method == "hrr":
-        if   frac < HRR_Z1: return "Z1"
-        elif frac < HRR_Z2: return "Z2"
-        elif frac < HRR_Z3: return "Z3"
-        elif frac < HRR_Z4: return "Z4"
-        elif frac < HRR_Z5: return "Z4"
-        else:               return "Z5"
-    else:  # hrmax
-        if   frac < HMX_Z1: return "Z1"
-        elif frac < HMX_Z2: return "Z2"
-        elif frac < HMX_Z3: return "Z3"
-        elif frac < HMX_Z4: return "Z4"
-        else:               return "Z5"
+    # 1 + bisect siempre cae en 1..5: índice directo, sin pasar por _int_to_zone
+    return _ZONE_STRS[_zone_int_by_method_id(frac, method_id(method))]
 
 
 # -------------------- Calorías (Keytel 2005) --------------------
-def kcal_per_min_keytel(hr: int, edad: int | None, peso_kg: float | None, sexo: str | None) -> float:
+# typed: 45 y 45.0 (o True y 1) no comparten entrada; una edad float cae en 30
+@lru_cache(maxsize=64, typed=True)
+def _keytel_coeffs(edad: int | None, peso_kg: float | None, sexo: str | None) -> Tuple[float, float]:
     """
-    - H: (-55.0969 + 0.6309*HR + 0.1988*peso + 0.2017*edad) / 4.184
-    - M: (-20.4022 + 0.4472*HR - 0.1263*peso + 0.0740*edad) / 4.184
+    Keytel es lineal en HR para (edad, peso, sexo) fijos: kcal/min = a + b*HR.
+    Devuelve (a, b) ya divididos por 4.184. Cacheado: el perfil es constante
+    durante la sesión, así que sexo/edad/peso no se re-validan en cada muestra.
     """
     edad = edad if isinstance(edad, int) else 30
     peso = float(peso_kg) if (isinstance(peso_kg, (int, float)) and peso_kg > 0) else 70.0
     s = (sexo or "").strip().upper()
     if s == "F":
-        return (-20.4022 + 0.4472 * hr - 0.1263 * peso + 0.0740 * edad) / 4.184
+        return (-20.4022 - 0.1263 * peso + 0.0740 * edad) / 4.184, 0.4472 / 4.184
     else:
-        return (-55.0969 + 0.6309 * hr + 0.1988 * peso + 0.2017 * edad) / 4.184
+        return (-55.0969 + 0.1988 * peso + 0.2017 * edad) / 4.184, 0.6309 / 4.184
+
+
+def kcal_per_min_keytel(hr: int, edad: int | None, peso_kg: float | None, sexo: str | None) -> float:
+    """
+    - H: (-55.0969 + 0.6309*HR + 0.1988*peso + 0.2017*edad) / 4.184
+    - M: (-20.4022 + 0.4472*HR - 0.1263*peso + 0.0740*edad) / 4.184
+    """
+    a, b = _keytel_coeffs(edad, peso_kg, sexo)
+    return a + b * hr
+
+
+# Ajuste "mixed" por bandas de intensidad: [recuperación, normal, Z4, Z5].
+# Bordes por método (en HRR la banda Z4 empieza en 80%, no coincide con la zona Z4).
+_ADJ_EDGES_HRR = (HRR_Z1, HRR_Z4, HRR_Z5)
+_ADJ_EDGES_HMX = (HMX_Z1, HMX_Z3, HMX_Z4)
+_ADJ_LUT_HRR = (MIXED_ADJ_REC_HRR, 1.0, MIXED_ADJ_Z4, MIXED_ADJ_Z5)
+_ADJ_LUT_HMX = (MIXED_ADJ_REC_HMX, 1.0, MIXED_ADJ_Z4, MIXED_ADJ_Z5)
+_ADJ_BY_METHOD = ((_ADJ_EDGES_HRR, _ADJ_LUT_HRR), (_ADJ_EDGES_HMX, _ADJ_LUT_HMX))  # índice = method_id
 
 
 def kcal_adjustment_factor(frac: float, method: str, mode: str) -> float:
@@ -126,52 +209,124 @@ def kcal_adjustment_factor(frac: float, method: str, mode: str) -> float:
     if m == "strength":
         return STRENGTH_ADJ
 
-    # mixed
-    if method == "hrr":
-        if frac >= HRR_Z5:  # ≥90% HRR
-            return MIXED_ADJ_Z5
-        if frac >= HRR_Z4:  # 80–89% HRR
-            return MIXED_ADJ_Z4
-        if frac < HRR_Z1:   # <50% HRR
-            return MIXED_ADJ_REC_HRR
-        return 1.0
-    else:
-        if frac >= HMX_Z4:  # ≥90% HRmax
-            return MIXED_ADJ_Z5
-        if frac >= HMX_Z3:  # 80–89% HRmax
-            return MIXED_ADJ_Z4
-        if frac < HMX_Z1:   # <60% HRmax
-            return MIXED_ADJ_REC_HMX
-        return 1.0
+    # mixed: índice de banda + tabla (sin escalera de ifs)
+    edges, lut = _ADJ_BY_METHOD[method_id(method)]
+    return lut[bisect_right(edges, frac)]
+
+
+_MODE_CARDIO, _MODE_STRENGTH, _MODE_MIXED = 0, 1, 2
+
+
+def _mode_id(mode: str | None) -> int:
+    m = (mode or "cardio").lower()
+    if m == "cardio":
+        return _MODE_CARDIO
+    if m == "strength":
+        return _MODE_STRENGTH
+    return _MODE_MIXED
 
 
 def kcal_per_min_adjusted(hr: int, edad: int | None, peso_kg: float | None, sexo: str | None,
                           frac: float, method: str, mode: str = "mixed") -> float:
-    base = kcal_per_min_keytel(hr, edad, peso_kg, sexo)
-    adj = kcal_adjustment_factor(frac, method, mode)
-    return max(0.0, base * adj)
+    a, b = _keytel_coeffs(edad, peso_kg, sexo)
+    return max(0.0, (a + b * hr) * kcal_adjustment_factor(frac, method, mode))
 
 
 # -------------------- Moov points --------------------
+_MOOV_MIN_BY_METHOD = (MOOV_MIN_HRR, MOOV_MIN_HMX)  # índice = method_id
+
+
 def moov_rate_per_min_from_frac(frac: float, method: str) -> float:
     """
     Tasa de puntos/min:
       - HRR: arranca a 50%
       - HRmax: arranca a 60%
     """
-    thr = MOOV_MIN_HRR if method == "hrr" else MOOV_MIN_HMX
+    thr = _MOOV_MIN_BY_METHOD[method_id(method)]
     if frac < thr:
         return 0.0
     return MOOV_ALPHA * (frac ** MOOV_BETA)
 
 
+# -------------------- Kernel por sesión --------------------
+def _make_kernel(method: str, mode: str | None, hr_max: int, hr_rest: Optional[int],
+                 edad: int | None, peso_kg: float | None, sexo: str | None):
+    """
+    Especializa el cálculo por muestra para un perfil/modo fijos (Keytel
+    como a + b*HR, con a/b de _keytel_coeffs inline para ahorrar una llamada).
+    Devuelve k(hr) -> (zona_int, kcal/min, puntos/min); la única variable libre es hr.
+    (método, modo y sexo se resuelven aquí una vez, no en cada muestra).
+    kcal/min puede ser negativa: quien integra ya descarta tasas <= 0, así que
+    aquí no se repite el max(0, ...). Para HR enteros 0..255 el resultado sale
+    de una tabla construida aquí (~256 entradas por sesión).
+    """
+    kcal_a, kcal_b = _keytel_coeffs(edad, peso_kg, sexo)
+    mid = method_id(method)
+    is_hrr = mid == METHOD_HRR
+    if hr_max <= 0:
+        off, denom = 0, 0.0
+    elif is_hrr:
+        off, denom = hr_rest, hr_max - hr_rest  # type: ignore[operator]
+        if denom < 1:
+            denom = 1
+    else:
+        off, denom = 0, float(hr_max)
+    moov_thr = _MOOV_MIN_BY_METHOD[mid]
+    zone_t = _ZONE_EDGES_BY_METHOD[mid]
+
+    mode_id = _mode_id(mode)
+    if mode_id != _MODE_MIXED:
+        # cardio/strength: ajuste constante -> se pliega en a/b (una sola FMA)
+        adj = 1.0 if mode_id == _MODE_CARDIO else STRENGTH_ADJ
+        ka, kb = kcal_a * adj, kcal_b * adj
+
+        def compute(hr: int) -> Tuple[int, float, float]:
+            frac = _clamp01((hr - off) / denom) if denom else 0.0
+            rate_mp = MOOV_ALPHA * (frac ** MOOV_BETA) if frac >= moov_thr else 0.0
+            return 1 + bisect_right(zone_t, frac), ka + kb * hr, rate_mp
+    else:
+        adj_edges, adj_lut = _ADJ_BY_METHOD[mid]
+
+        def compute(hr: int) -> Tuple[int, float, float]:
+            frac = _clamp01((hr - off) / denom) if denom else 0.0
+            rate_kcal = (kcal_a + kcal_b * hr) * adj_lut[bisect_right(adj_edges, frac)]
+            rate_mp = MOOV_ALPHA * (frac ** MOOV_BETA) if frac >= moov_thr else 0.0
+            return 1 + bisect_right(zone_t, frac), rate_kcal, rate_mp
+
+    # HR entero en 0..255 (byte ANT+): resultado precalculado, cada muestra es un índice
+    table = tuple(compute(h) for h in range(HR_LUT_SIZE))
+
+    def kernel(hr: int) -> Tuple[int, float, float]:
+        if hr.__class__ is int and 0 <= hr < HR_LUT_SIZE:
+            return table[hr]
+        return compute(hr)
+
+    return kernel
+
+
 # -------------------- Sesión --------------------
+def _profile_key(user: dict | None, mode: str) -> tuple:
+    """Valores del perfil que afectan al cálculo (por valor: ve ediciones in situ)."""
+    if not user:
+        return (None, None, None, None, None, None, mode)
+    g = user.get
+    return (g("id"), g("edad"), g("peso"), g("sexo"), g("hr_max"), g("hr_rest"), mode)
+
+
 class _Sess:
-    __slots__ = ("last_ts", "kcal_total", "moov_total")
+    __slots__ = ("last_ts_ms", "kcal_total", "moov_total", "kernel_sig", "kernel",
+                 "user_key", "user_snap")
     def __init__(self):
-        self.last_ts = None
+        self.last_ts_ms = None
         self.kcal_total = 0.0
         self.moov_total = 0.0
+        # Kernel especializado para la firma de perfil/modo actual
+        self.kernel_sig = None
+        self.kernel = None
+        # Snapshot del perfil: (hr_max, method), válido mientras _profile_key
+        # (valores del perfil + modo) no cambie
+        self.user_key = None
+        self.user_snap = None
 
 
 class SessionStore:
@@ -181,70 +336,189 @@ class SessionStore:
       - Si no, %HRmax.
     Ajustes energéticos y puntos se adaptan al método activo.
     """
-    def __init__(self):
-        self._by_dev = {}
+    def __init__(self, index_shift: int = 0):
+        self._by_dev: list = []      # (dev_id >> index_shift) -> _Sess|None (denso, dev_id <= DENSE_MAX_DEV_ID)
+        self._by_dev_sparse = {}     # dev_id -> _Sess (resto: DEMO, simulados altos...)
+        # >0 cuando el store es un shard: sus dev_id comparten los bits bajos
+        self._index_shift = index_shift
 
     def clear(self, dev_id: int | None = None):
         if dev_id is None:
             self._by_dev.clear()
+            self._by_dev_sparse.clear()
+        elif 0 <= dev_id <= DENSE_MAX_DEV_ID:
+            slot = dev_id >> self._index_shift
+            if slot < len(self._by_dev):
+                self._by_dev[slot] = None
         else:
-            self._by_dev.pop(dev_id, None)
+            self._by_dev_sparse.pop(dev_id, None)
+
+    def _get_or_create(self, dev_id: int) -> _Sess:
+        if 0 <= dev_id <= DENSE_MAX_DEV_ID:
+            slot = dev_id >> self._index_shift
+            slots = self._by_dev
+            if slot >= len(slots):
+                slots.extend([None] * (slot + 1 - len(slots)))
+            sess = slots[slot]
+            if sess is None:
+                sess = slots[slot] = _Sess()
+            return sess
+        sess = self._by_dev_sparse.get(dev_id)
+        if sess is None:
+            sess = self._by_dev_sparse[dev_id] = _Sess()
+        return sess
 
-    def update(self, dev_id: int, user: dict | None, hr: int | None, ts_iso: str | None,
-               mode: str = "mixed"):
-        """
-        user esperado (si existe): {"edad": int, "peso": float, "sexo": "M"/"F",
-                                    "hr_max": int?, "hr_rest": int?}
-        """
+    @staticmethod
+    def _load_profile(sess: _Sess, user: dict | None, mode: str, key: tuple):
         edad = user.get("edad") if user else None
         hr_max_user = user.get("hr_max") if user else None
         hr_max = hrmax_from_user_or_estimada(edad, hr_max_user)
 
         method, hr_rest = pick_method(user)  # "hrr" usa hr_rest del perfil; si no, "hrmax"
+        peso = user.get("peso") if user else None
+        sexo = user.get("sexo") if user else None
+
+        # Kernel: reconstruir solo si cambia el perfil o el modo
+        sig = (method, mode, hr_max, hr_rest, edad, peso, sexo)
+        if sess.kernel_sig != sig:
+            sess.kernel = _make_kernel(method, mode, hr_max, hr_rest, edad, peso, sexo)
+            sess.kernel_sig = sig
+        sess.user_key = key
+        sess.user_snap = (hr_max, method)
 
+    def update(self, dev_id: int, user: dict | None, hr: int | None, ts_iso: str | None,
+               mode: str = "mixed"):
+        """
+        user esperado (si existe): {"edad": int, "peso": float, "sexo": "M"/"F",
+                                    "hr_max": int?, "hr_rest": int?}
+        """
         if dev_id is None:
+            edad = user.get("edad") if user else None
+            method, _ = pick_method(user)
             return {
-                "hr_max": hr_max,
+                "hr_max": hrmax_from_user_or_estimada(edad, user.get("hr_max") if user else None),
                 "method": method,
                 "zone": "Z1",
                 "kcal": 0.0,
                 "moov_points": 0.0,
             }
 
-        sess = self._by_dev.get(dev_id)
-        if sess is None:
-            sess = _Sess()
-            self._by_dev[dev_id] = sess
+        sess = self._get_or_create(dev_id)
 
-        ts = _parse_ts(ts_iso)
-        peso = user.get("peso") if user else None
-        sexo = user.get("sexo") if user else None
+        ts_ms = parse_ts_ms(ts_iso)
 
-        # Fracción de intensidad y zona
-        if method == "hrr":
-            frac = frac_hrr(hr, hr_max, hr_rest)  # type: ignore[arg-type]
-        else:
-            frac = frac_hrmax(hr, hr_max)
-        zcode = zone_code_from_frac(frac, method)
-
-        # Integración temporal
-        if ts and (hr is not None):
-            if sess.last_ts:
-                dt_min = max(0.0, (ts - sess.last_ts).total_seconds() / 60.0)
-                if dt_min > 0.0:
-                    rate_kcal = kcal_per_min_adjusted(hr, edad, peso, sexo, frac, method, mode=mode)
-                    if rate_kcal > 0:
-                        sess.kcal_total += rate_kcal * dt_min
-                    rate_mp = moov_rate_per_min_from_frac(frac, method)
-                    if rate_mp > 0:
-                        sess.moov_total += rate_mp * dt_min
-            sess.last_ts = ts
+        # Perfil: HRmax/método/kernel solo se recalculan si cambia algún valor
+        key = _profile_key(user, mode)
+        if key != sess.user_key:
+            self._load_profile(sess, user, mode, key)
+        hr_max, method = sess.user_snap
 
+        if hr is None:
+            zint = 1  # frac=0 -> Z1
+        else:
+            zint, rate_kcal, rate_mp = sess.kernel(hr)
+
+            # Integración temporal
+            if ts_ms is not None:
+                if sess.last_ts_ms is not None:
+                    dt_ms = ts_ms - sess.last_ts_ms
+                    if dt_ms > 0:
+                        dt_min = dt_ms * _INV_60000
+                        if rate_kcal > 0:
+                            sess.kcal_total += rate_kcal * dt_min
+                        if rate_mp > 0:
+                            sess.moov_total += rate_mp * dt_min
+                sess.last_ts_ms = ts_ms
+
+        # dict nuevo en cada llamada: /live lo guarda en caché y lo serializa
+        # fuera del lock del shard, así que no puede compartirse entre muestras
         return {
             "hr_max": hr_max,
             "method": method,   # "hrr" o "hrmax" (útil para UI/log)
-            "zone": zcode,
-            "kcal": round(sess.kcal_total, 3),
-            "moov_points": round(sess.moov_total, 3),
+            "zone": _ZONE_STRS[zint],
+            "kcal": _round3(sess.kcal_total),
+            "moov_points": _round3(sess.moov_total),
             # "h_frac": round(frac, 4),  # descomenta si quieres depurar
         }
+
+    def update_batch(self, dev_id: int, user: dict | None, samples, mode: str = "mixed"):
+        """
+        Como update() para un bloque de muestras [(ts_ms, hr), ...] en orden
+        (p. ej. al reenviar historial tras una reconexión). Sin None: filtra antes.
+        Misma integración que muestra a muestra, pero en una pasada NumPy:
+        el kernel solo se evalúa una vez por HR distinto.
+        Bloque vacío: no integra nada y la zona queda en Z1 (como hr=None).
+        """
+        if dev_id is None:
+            return self.update(None, user, None, None, mode=mode)
+
+        sess = self._get_or_create(dev_id)
+        key = _profile_key(user, mode)
+        if key != sess.user_key:
+            self._load_profile(sess, user, mode, key)
+        hr_max, method = sess.user_snap
+
+        arr = np.asarray(samples, dtype=np.int64).reshape(-1, 2)
+        zint = 1
+        if arr.shape[0]:
+            ts, hr = arr[:, 0], arr[:, 1]
+
+            uniq, inv = np.unique(hr, return_inverse=True)
+            k = sess.kernel
+            zs, kpm, mpm = (np.array(c) for c in zip(*[k(h) for h in uniq.tolist()]))
+
+            last = sess.last_ts_ms
+            dt_ms = np.diff(ts, prepend=ts[0] if last is None else last)
+            dt_min = np.where(dt_ms > 0, dt_ms, 0) * _INV_60000
+            kpm, mpm = kpm[inv], mpm[inv]
+            sess.kcal_total += float(np.dot(np.where(kpm > 0, kpm, 0.0), dt_min))
+            sess.moov_total += float(np.dot(np.where(mpm > 0, mpm, 0.0), dt_min))
+            sess.last_ts_ms = int(ts[-1])
+            zint = int(zs[inv[-1]])
+
+        return {
+            "hr_max": hr_max,
+            "method": method,
+            "zone": _ZONE_STRS[zint],
+            "kcal": _round3(sess.kcal_total),
+            "moov_points": _round3(sess.moov_total),
+        }
+
+
+class ShardedSessionStore:
+    """
+    SessionStore repartido en N shards (dev_id & (N-1)), cada uno con su lock.
+    Misma API que SessionStore; pensado para Flask con threaded=True, donde
+    varias peticiones /live pueden actualizar sesiones a la vez.
+    """
+    def __init__(self, n_shards: int = 16):
+        bits = max(0, int(n_shards) - 1).bit_length()  # redondea a potencia de 2
+        self._mask = (1 << bits) - 1
+        self._shards = [SessionStore(index_shift=bits) for _ in range(1 << bits)]
+        self._locks = [threading.Lock() for _ in range(1 << bits)]
+
+    def clear(self, dev_id: int | None = None):
+        if dev_id is None:
+            for store, lock in zip(self._shards, self._locks):
+                with lock:
+                    store.clear()
+            return
+        i = dev_id & self._mask
+        with self._locks[i]:
+            self._shards[i].clear(dev_id)
+
+    def update(self, dev_id: int, user: dict | None, hr: int | None, ts_iso: str | None,
+               mode: str = "mixed"):
+        if dev_id is None:
+            # sin sesión asociada: no toca estado compartido
+            return self._shards[0].update(None, user, hr, ts_iso, mode=mode)
+        i = dev_id & self._mask
+        with self._locks[i]:
+            return self._shards[i].update(dev_id, user, hr, ts_iso, mode=mode)
+
+    def update_batch(self, dev_id: int, user: dict | None, samples, mode: str = "mixed"):
+        if dev_id is None:
+            return self._shards[0].update_batch(None, user, samples, mode=mode)
+        i = dev_id & self._mask
+        with self._locks[i]:
+            return self._shards[i].update_batch(dev_id, user, samples, mode=mode)
@@ -10,8 +10,15 @@ Gestor de sesiones/clases con:
 """
 
 import time
+import queue
+import atexit
 import sqlite3
-from typing import Optional, Dict, Any, List, Tuple
+import threading
+from contextlib import contextmanager
+from bisect import bisect_right
+from itertools import accumulate, groupby
+from operator import itemgetter
+from typing import Optional, Dict, Any, List, Tuple, NamedTuple
 from pathlib import Path
 
 # ======================= COLORES =======================
@@ -23,6 +30,10 @@ COLOR_BLUE   = "#1d4ed8"  # cooldown
 DB_PATH = Path("sessions.db")
 
 # ======================= INIT DB =======================
+# Revisión del esquema guardada en PRAGMA user_version; si la DB ya está en
+# ella, init_db_with_defaults no repite DDL ni semillas. Subirla al tocar DDL.
+SCHEMA_VERSION = 1
+
 DDL = [
     # clases
     """
@@ -51,6 +62,11 @@ DDL = [
         time_str TEXT NOT NULL -- 'HH:MM'
     );
     """,
+    # disparo por calendario: WHERE dow=? AND time_str=?. sched_id es el rowid
+    # y va implícito en el índice, así que la consulta se resuelve solo con él.
+    """
+    CREATE INDEX IF NOT EXISTS idx_weekly_dow_time ON weekly_schedule(dow, time_str);
+    """,
     # programaciones puntuales por fecha concreta (SOLO día, sin hora)
     """
     CREATE TABLE IF NOT EXISTS one_off_schedule (
@@ -78,19 +94,134 @@ DDL = [
 ]
 
 
-def _connect():
-    conn = sqlite3.connect(DB_PATH)
+# Un escritor + N lectores (WAL permite leer mientras se escribe).
+# - Escritor: conexión única y persistente. Flask sirve en varios hilos:
+#   el RLock serializa las escrituras y permite anidar _writer() dentro del
+#   mismo hilo (p.ej. autostart -> start).
+# - Lectores: conexiones en solo-lectura (query_only) que se reciclan en un
+#   pool; se abren bajo demanda, como mucho READER_POOL_MAX (una lectura más
+#   espera a que se libere una). Todas se cierran al salir del proceso.
+READER_POOL_MAX = 8
+_CONN: Optional[sqlite3.Connection] = None
+_CONN_LOCK = threading.RLock()
+_READERS: "queue.SimpleQueue[sqlite3.Connection]" = queue.SimpleQueue()
+_READER_SLOTS = threading.BoundedSemaphore(READER_POOL_MAX)
+
+
+# SQL de las rutas calientes (status/autostart/catálogo) como constantes: el texto
+# exacto es la clave de la caché de sentencias preparadas de cada conexión.
+_SQL_PHASES_BY_CLASS = "SELECT idx,phase_key,dur_s,color FROM class_phases WHERE class_id=? ORDER BY idx"
+_SQL_INSERT_PHASE = "INSERT INTO class_phases(class_id,idx,phase_key,dur_s,color) VALUES(?,?,?,?,?)"
+_SQL_CLASSES_JOIN = (
+    "SELECT c.id, c.label, p.idx, p.phase_key, p.dur_s, p.color "
+    "FROM classes c LEFT JOIN class_phases p ON p.class_id = c.id "
+    "ORDER BY LOWER(c.label), c.id, p.idx"
+)
+_SQL_WEEKLY_LIST = "SELECT sched_id,dow,time_str FROM weekly_schedule ORDER BY dow,time_str"
+_SQL_ONEOFF_LIST = "SELECT ymd,class_id FROM one_off_schedule ORDER BY ymd"
+_SQL_DEFAULT_CLASS = "SELECT value FROM settings WHERE key='default_class_id'"
+_SQL_WEEKLY_ALL = "SELECT sched_id, dow, time_str FROM weekly_schedule ORDER BY sched_id"
+_SQL_ONEOFF_BY_DAY = "SELECT class_id FROM one_off_schedule WHERE ymd=?"
+# Disparos semanales de ese minuto aún sin consumir ese día (una sola consulta)
+_SQL_WEEKLY_PENDING = (
+    "SELECT w.sched_id FROM weekly_schedule w "
+    "LEFT JOIN schedule_log s ON s.sched_id=w.sched_id AND s.ymd=? "
+    "WHERE w.dow=? AND w.time_str=? AND s.sched_id IS NULL ORDER BY w.sched_id"
+)
+_SQL_LOG_UPSERT = "INSERT OR REPLACE INTO schedule_log(sched_id, ymd, last_start_ts) VALUES(?,?,?)"
+_CACHED_STATEMENTS = 256
+# INSERT ... RETURNING existe desde SQLite 3.35
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# PRAGMAs por conexión (no persisten en el fichero, salvo journal_mode).
+# mmap_size es solo un tope: se mapea lo que ocupe la DB (pocos MB).
+_MMAP_SIZE = 64 * 1024 * 1024
+_BUSY_TIMEOUT_MS = 5000
+_WAL_AUTOCHECKPOINT = 1000  # páginas; respaldo si nunca hay ratos libres
+WAL_CHECKPOINT_IDLE_S = 5 * 60  # checkpoint en reposo como mucho cada 5 minutos
+
+
+def _configure(conn: sqlite3.Connection):
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout={_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size={_MMAP_SIZE}")
+
+
+def _get_conn() -> sqlite3.Connection:
+    global _CONN
+    if _CONN is None:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=_CACHED_STATEMENTS)
+        _configure(conn)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # en WAL: fsync en checkpoint, no por commit
+        conn.execute(f"PRAGMA wal_autocheckpoint={_WAL_AUTOCHECKPOINT}")
+        _CONN = conn
+    return _CONN
+
+
+def _open_reader() -> sqlite3.Connection:
+    with _CONN_LOCK:
+        _get_conn()  # asegura fichero en modo WAL antes de abrir lectores
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=_CACHED_STATEMENTS)
+    _configure(conn)
+    conn.execute("PRAGMA query_only=1")
     return conn
 
 
+@contextmanager
+def _writer():
+    """Presta la conexión de escritura bajo _CONN_LOCK; rollback si algo falla."""
+    with _CONN_LOCK:
+        con = _get_conn()
+        try:
+            yield con
+        except BaseException:
+            con.rollback()
+            raise
+
+
+def _begin(con: sqlite3.Connection):
+    """Abre transacción explícita (reserva el lock de escritura desde el inicio)."""
+    if not con.in_transaction:
+        con.execute("BEGIN IMMEDIATE")
+
+
+@contextmanager
+def _reader():
+    """Presta una conexión de solo lectura del pool (sin bloquear al escritor)."""
+    with _READER_SLOTS:
+        try:
+            con = _READERS.get_nowait()
+        except queue.Empty:
+            con = _open_reader()
+        try:
+            yield con
+        finally:
+            _READERS.put(con)
+
+
+@atexit.register
+def _close_connections():
+    """Cierra los lectores del pool y la conexión de escritura."""
+    global _CONN
+    while True:
+        try:
+            _READERS.get_nowait().close()
+        except queue.Empty:
+            break
+    with _CONN_LOCK:
+        if _CONN is not None:
+            _CONN.close()
+            _CONN = None
+
+
 def init_db_with_defaults():
-    if not DB_PATH.exists():
-        pass
-    with _connect() as con:
+    with _writer() as con:
         cur = con.cursor()
+        if cur.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
         for stmt in DDL:
-            cur.executescript(stmt)
+            cur.execute(stmt)  # una sentencia por entrada: sin executescript
         # Inserta clase por defecto si no existe
         cur.execute("SELECT COUNT(*) c FROM classes")
         if cur.fetchone()["c"] == 0:
@@ -108,11 +239,12 @@ def init_db_with_defaults():
                 ("moov", 9, "COOLDOWN", 3*60, COLOR_BLUE),
             ]
             cur.executemany(
-                "INSERT INTO class_phases(class_id,idx,phase_key,dur_s,color) VALUES(?,?,?,?,?)",
+                _SQL_INSERT_PHASE,
                 phases,
             )
         # valor por defecto de clase global
         cur.execute("INSERT OR IGNORE INTO settings(key,value) VALUES('default_class_id','moov')")
+        cur.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
         con.commit()
 
 
@@ -120,130 +252,269 @@ def init_db_with_defaults():
 
 def list_class_models() -> List[Dict[str, Any]]:
     """Devuelve lista: [{id, label, total_s, phases:[{key,dur_s,color,idx}]}]"""
-    with _connect() as con:
-        cur = con.cursor()
-        cur.execute("SELECT id,label FROM classes ORDER BY LOWER(label)")
-        rows = cur.fetchall()
-        out: List[Dict[str, Any]] = []
-        for r in rows:
-            cid, label = r["id"], r["label"]
-            cur.execute("SELECT idx,phase_key,dur_s,color FROM class_phases WHERE class_id=? ORDER BY idx", (cid,))
-            ph_rows = cur.fetchall()
-            phases = [
-                {"idx": pr["idx"], "key": pr["phase_key"], "dur_s": pr["dur_s"], "color": pr["color"]}
-                for pr in ph_rows
-            ]
-            total = sum(p["dur_s"] for p in phases)
-            out.append({"id": cid, "label": label, "total_s": total, "phases": phases})
-        return out
+    with _reader() as con:
+        # una sola consulta (JOIN) en lugar de una por clase
+        rows = con.execute(_SQL_CLASSES_JOIN).fetchall()
+    return _class_models_from_rows(rows)
+
+
+_DUR_S = itemgetter("dur_s")
+
+
+def _class_models_from_rows(rows) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    for (cid, label), grp in groupby(rows, key=lambda r: (r["id"], r["label"])):
+        phases = [
+            {"idx": pr["idx"], "key": pr["phase_key"], "dur_s": pr["dur_s"], "color": pr["color"]}
+            for pr in grp if pr["idx"] is not None  # clase sin fases -> fila con NULLs
+        ]
+        total = sum(map(_DUR_S, phases))
+        out.append({"id": cid, "label": label, "total_s": total, "phases": phases})
+    return out
 
 
 def upsert_class(class_id: str, label: str, phases: List[Dict[str, Any]]):
     """Crea o actualiza una clase completa (sobrescribe fases por índice)."""
     if class_id == "moov":
         raise ValueError("Moov Class no se puede editar.")
-    with _connect() as con:
+    with _writer() as con:
+        _begin(con)
         cur = con.cursor()
         cur.execute(
             "INSERT INTO classes(id,label) VALUES(?,?) ON CONFLICT(id) DO UPDATE SET label=excluded.label",
             (class_id, label))
         cur.execute("DELETE FROM class_phases WHERE class_id=?", (class_id,))
-        for i, ph in enumerate(phases):
-            cur.execute(
-                "INSERT INTO class_phases(class_id,idx,phase_key,dur_s,color) VALUES(?,?,?,?,?)",
-                (class_id, i, str(ph["key"]), int(ph["dur_s"]), ph.get("color") or COLOR_YELLOW),
-            )
+        cur.executemany(
+            _SQL_INSERT_PHASE,
+            ((class_id, i, str(ph["key"]), int(ph["dur_s"]), ph.get("color") or COLOR_YELLOW)
+             for i, ph in enumerate(phases)),
+        )
         con.commit()
+        _invalidate_phases()
+    SESSION.invalidate_status()
 
 
 def delete_class(class_id: str):
     if class_id == "moov":
         raise ValueError("Moov Class no se puede eliminar.")
-    with _connect() as con:
+    with _writer() as con:
         con.execute("DELETE FROM classes WHERE id=?", (class_id,))
         con.commit()
+        _invalidate_phases()
+    SESSION.invalidate_status()
 
 
 def get_phases(class_id: Optional[str]) -> List[Dict[str, Any]]:
     if not class_id:
         return []
-    with _connect() as con:
+    with _reader() as con:
         cur = con.cursor()
-        cur.execute("SELECT idx,phase_key,dur_s,color FROM class_phases WHERE class_id=? ORDER BY idx", (class_id,))
+        cur.execute(_SQL_PHASES_BY_CLASS, (class_id,))
         rows = cur.fetchall()
         return [
             {"idx": r["idx"], "key": r["phase_key"], "dur_s": r["dur_s"], "color": r["color"]}
             for r in rows
         ]
 
+
+# Fases por clase en columnas (SoA) + sumas acumuladas, para el sondeo de
+# status(). El catálogo solo cambia con upsert_class/delete_class, que suben
+# _PHASES_VER; una lectura hecha mientras tanto no se guarda.
+class Phases(NamedTuple):
+    durs: Tuple[int, ...]
+    keys: Tuple[str, ...]
+    colors: Tuple[str, ...]
+    prefix: Tuple[int, ...]  # fin (s) de cada fase desde el inicio
+    total: int
+
+    def phase(self, i: int) -> Dict[str, Any]:
+        return {"idx": i, "key": self.keys[i], "dur_s": self.durs[i], "color": self.colors[i]}
+
+
+_EMPTY_PHASES = Phases((), (), (), (), 0)
+_PHASES_VER = 0
+_PHASE_CACHE: Dict[str, Phases] = {}
+
+
+def _invalidate_phases():
+    global _PHASES_VER
+    _PHASES_VER += 1
+    _PHASE_CACHE.clear()
+
+
+def _get_phases_cached(class_id: Optional[str]) -> Phases:
+    if not class_id:
+        return _EMPTY_PHASES
+    ph = _PHASE_CACHE.get(class_id)
+    if ph is None:
+        ver = _PHASES_VER
+        rows = get_phases(class_id)
+        durs = tuple(p["dur_s"] for p in rows)
+        prefix = tuple(accumulate(durs))
+        ph = Phases(durs, tuple(p["key"] for p in rows), tuple(p["color"] for p in rows),
+                    prefix, prefix[-1] if prefix else 0)
+        if ver == _PHASES_VER:
+            _PHASE_CACHE[class_id] = ph
+    return ph
+
 # ----- settings -----
 
 def get_default_class_id() -> str:
-    with _connect() as con:
-        row = con.execute("SELECT value FROM settings WHERE key='default_class_id'").fetchone()
+    with _reader() as con:
+        row = con.execute(_SQL_DEFAULT_CLASS).fetchone()
         return (row["value"] if row else "moov")
 
 def set_default_class_id(cid: str):
-    with _connect() as con:
+    with _writer() as con:
         con.execute(
             "INSERT INTO settings(key,value) VALUES('default_class_id',?) "
             "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
             (cid,))
         con.commit()
+    SESSION.set_default_class(cid)
 
 
 # ======================= HELPERS COUNTDOWN SEMANAL =======================
 
 WEEKLY_LEAD_S = 5 * 60  # 5 minutos
 
+# Epochs ya resueltos para el día local en curso: {(days_ahead, hh, mm): epoch}.
+# Se tira el dict entero al cambiar de día; mktime sigue resolviendo cada
+# entrada una vez, así que los cambios de horario (DST) salen bien.
+_EPOCH_DAY_START = 0.0
+_EPOCH_DAY_END = 0.0
+_EPOCH_MEMO: Dict[Tuple[int, int, int], float] = {}
+
+
 def _mk_epoch_for_local(hh: int, mm: int, days_ahead: int = 0) -> float:
     """Construye epoch local para hoy + days_ahead a HH:MM (segundos=0)."""
-    import time as _t
-    tm = _t.localtime()
-    # mktime se encarga del overflow de día/mes
-    target = _t.struct_time((
-        tm.tm_year, tm.tm_mon, tm.tm_mday + days_ahead,
-        hh, mm, 0,  # H M S
-        -1, -1, -1
-    ))
-    return _t.mktime(target)
+    global _EPOCH_DAY_START, _EPOCH_DAY_END, _EPOCH_MEMO
+    now = time.time()
+    memo = _EPOCH_MEMO
+    if not (_EPOCH_DAY_START <= now < _EPOCH_DAY_END):
+        tm = time.localtime(now)
+        memo = {}
+        _EPOCH_DAY_START = time.mktime((tm.tm_year, tm.tm_mon, tm.tm_mday, 0, 0, 0, -1, -1, -1))
+        _EPOCH_DAY_END = time.mktime((tm.tm_year, tm.tm_mon, tm.tm_mday + 1, 0, 0, 0, -1, -1, -1))
+        _EPOCH_MEMO = memo
+    key = (days_ahead, hh, mm)
+    t = memo.get(key)
+    if t is None:
+        # Medianoche + aritmética; si el reloj local no marca HH:MM es que hay
+        # un cambio de hora por medio (u hora inexistente): ahí decide mktime
+        t = _EPOCH_DAY_START + days_ahead * 86400 + hh * 3600 + mm * 60
+        lt = time.localtime(t)
+        if lt.tm_hour == hh and lt.tm_min == mm:
+            memo[key] = t
+            return t
+        tm = time.localtime(_EPOCH_DAY_START)
+        # mktime se encarga del overflow de día/mes
+        t = memo[key] = time.mktime((
+            tm.tm_year, tm.tm_mon, tm.tm_mday + days_ahead,
+            hh, mm, 0,  # H M S
+            -1, -1, -1
+        ))
+    return t
+
+# weekly_schedule en memoria. Se consulta en cada status() pero solo cambia con
+# el CRUD semanal, que sube _WEEKLY_VER; una lectura solo se da por buena si no
+# hubo escrituras mientras se hacía. Guarda (ver, parsed, by_minute):
+#   parsed    -> [(sched_id, dow, hh, mm)] para la cuenta atrás
+#   by_minute -> {(dow, time_str): [sched_id, ...]} para el disparo exacto
+#                (time_str tal cual está en la DB, igual que el WHERE original)
+_WEEKLY_VER = 0
+_WEEKLY_CACHE: Optional[Tuple[int, List[Tuple[int, int, int, int]], Dict[Tuple[int, str], List[int]]]] = None
+
+
+def _invalidate_weekly():
+    global _WEEKLY_VER, _WEEKLY_CACHE
+    _WEEKLY_VER += 1
+    _WEEKLY_CACHE = None
+
+
+def _load_weekly():
+    global _WEEKLY_CACHE
+    c = _WEEKLY_CACHE
+    if c is not None and c[0] == _WEEKLY_VER:
+        return c
+    ver = _WEEKLY_VER
+    with _reader() as con:
+        rows = con.execute(_SQL_WEEKLY_ALL).fetchall()
+    parsed = []
+    by_minute: Dict[Tuple[int, str], List[int]] = {}
+    for r in rows:
+        sched_id, dow, time_str = int(r["sched_id"]), int(r["dow"]), r["time_str"]
+        by_minute.setdefault((dow, time_str), []).append(sched_id)
+        hh, mm = map(int, str(time_str)[:5].split(":"))
+        parsed.append((sched_id, dow, hh, mm))
+    c = _WEEKLY_CACHE = (ver, parsed, by_minute)
+    return c
+
+
+def _weekly_rows() -> List[Tuple[int, int, int, int]]:
+    return _load_weekly()[1]
+
+
+def _weekly_by_minute() -> Dict[Tuple[int, str], List[int]]:
+    return _load_weekly()[2]
+
+
+# Última respuesta de _next_weekly_occurrence, por (versión de weekly, minuto).
+# Los candidatos caen en minutos exactos, así que "t0 < now" da lo mismo para
+# todo now del mismo minuto redondeado hacia arriba (:00 exacto es otro minuto).
+_NEXT_WEEKLY_MEMO: Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, float]]] = (None, None)
+
 
 def _next_weekly_occurrence(now: float) -> Optional[Tuple[int, float]]:
     """
     Devuelve (sched_id, epoch) del siguiente horario semanal >= now,
     buscando en los próximos 7 días.
     """
-    import time as _t
-    with _connect() as con:
-        rows = con.execute("SELECT sched_id, dow, time_str FROM weekly_schedule").fetchall()
-    if not rows:
-        return None
-
-    tm_now = _t.localtime(now)
-    now_dow = tm_now.tm_wday  # 0..6
-    candidates: List[Tuple[int, float]] = []
+    global _NEXT_WEEKLY_MEMO
+    key = (_WEEKLY_VER, int(-(-now // 60)))
+    memo_key, res = _NEXT_WEEKLY_MEMO
+    if memo_key == key:
+        return res
 
-    for r in rows:
-        sched_id = int(r["sched_id"])
-        dow = int(r["dow"])
-        hh, mm = map(int, str(r["time_str"])[:5].split(":"))
+    rows = _weekly_rows()
+    if not rows:
+        res = None
+    else:
+        now_dow = time.localtime(now).tm_wday  # 0..6
+        candidates: List[Tuple[int, float]] = []
 
-        delta_days = (dow - now_dow) % 7
-        t0 = _mk_epoch_for_local(hh, mm, days_ahead=delta_days)
-        if t0 < now:
-            # si ya pasó hoy, empuja a la semana siguiente
-            t0 = _mk_epoch_for_local(hh, mm, days_ahead=(delta_days + 7))
-        candidates.append((sched_id, t0))
+        for sched_id, dow, hh, mm in rows:
+            delta_days = (dow - now_dow) % 7
+            t0 = _mk_epoch_for_local(hh, mm, days_ahead=delta_days)
+            if t0 < now:
+                # si ya pasó hoy, empuja a la semana siguiente
+                t0 = _mk_epoch_for_local(hh, mm, days_ahead=(delta_days + 7))
+            candidates.append((sched_id, t0))
 
-    sched_id, epoch = min(candidates, key=lambda x: x[1])
-    return (sched_id, epoch)
+        res = min(candidates, key=lambda x: x[1])
+    _NEXT_WEEKLY_MEMO = (key, res)
+    return res
 
 
 # ======================= SESSION MANAGER =======================
 
 class SessionManager:
+    # estado fijo (sin __dict__): acceso por descriptor de slot en cada status()
+    __slots__ = (
+        "active", "class_id", "_phases", "start_ts", "paused", "pause_ts", "pause_accum",
+        "scheduled_ts", "lead_s", "_start_mono", "_pause_mono", "_status_cache",
+        "_default_class_id", "_consumed_ymd", "_consumed_today", "_oneoff_memo",
+        "_tick", "_last_ckpt_mono",
+    )
+
     def __init__(self):
         init_db_with_defaults()
+        self._default_class_id: Optional[str] = None  # copia de settings; la fija set_default_class
+        self._consumed_ymd: Optional[str] = None   # día de _consumed_today
+        self._consumed_today: set = set()          # sched_id ya disparados ese día
+        self._oneoff_memo: Tuple[Optional[str], Optional[str]] = (None, None)  # (ymd, class_id)
+        self._tick: Tuple[int, Tuple[int, str, str]] = (-1, (0, "", ""))  # (minuto epoch, campos)
+        self._last_ckpt_mono: float = time.monotonic()
         self.reset()
 
     # -------- Estado ----------
@@ -251,57 +522,95 @@ class SessionManager:
         self.active: bool = False
         self.class_id: Optional[str] = None
         self.start_ts: Optional[float] = None
-        self.phases: List[Dict[str, Any]] = []
+        self._start_mono: Optional[float] = None  # mismo instante que start_ts, en reloj monotónico
+        self._phases: Phases = _EMPTY_PHASES
         self.scheduled_ts: Optional[float] = None  # manual puntual
         self.lead_s: int = 0
         self.paused: bool = False
         self.pause_ts: Optional[float] = None
+        self._pause_mono: Optional[float] = None
         self.pause_accum: int = 0
+        self._status_cache: Optional[Tuple[tuple, dict]] = None
+
+    def invalidate_status(self):
+        """Descarta la respuesta de status() cacheada (cambió estado o catálogo)."""
+        self._status_cache = None
+
+    @property
+    def phases(self) -> List[Dict[str, Any]]:
+        """Fases de la clase en curso: [{idx, key, dur_s, color}] (copia nueva)."""
+        P = self._phases
+        return [P.phase(i) for i in range(len(P.durs))]
+
+    def set_default_class(self, cid: str):
+        """Actualiza la copia en memoria de la clase por defecto (ya guardada en settings)."""
+        self._default_class_id = cid
+        self.invalidate_status()
 
     # -------- Helpers internos ----------
     def _now(self) -> float:
         return time.time()
 
-    def _total_dur(self, phases: Optional[list]) -> int:
-        return sum(p["dur_s"] for p in (phases or []))
+    def _mono(self) -> float:
+        # lo transcurrido se mide en monotónico: no salta con NTP/ajustes de hora
+        return time.monotonic()
+
+    def _get_default_cached(self) -> str:
+        cid = self._default_class_id
+        if cid is None:
+            cid = self._default_class_id = get_default_class_id()
+        return cid
 
-    def _elapsed(self, now=None) -> int:
-        if self.start_ts is None:
+    def _elapsed(self, mono=None) -> int:
+        if self._start_mono is None:
             return 0
-        if now is None:
-            now = self._now()
-        base = int(now - self.start_ts)
+        if mono is None:
+            mono = self._mono()
+        base = int(mono - self._start_mono)
         paused_extra = self.pause_accum
-        if self.paused and self.pause_ts is not None:
-            paused_extra += int(now - self.pause_ts)
+        if self.paused and self._pause_mono is not None:
+            paused_extra += int(mono - self._pause_mono)
         return max(0, base - paused_extra)
 
-    def _progress(self, phases, start_ts, now=None) -> Tuple[int,int,Optional[int],int,int,Optional[dict]]:
-        if not phases or start_ts is None:
+    def _progress(self, phases: Phases, start_ts, mono=None) -> Tuple[int,int,Optional[int],int,int,Optional[dict]]:
+        if not phases.durs or start_ts is None:
             return (0, 0, None, 0, 0, None)
-        if now is None:
-            now = self._now()
-        total = self._total_dur(phases)
-        elapsed = self._elapsed(now)
+        prefix = phases.prefix
+        total = phases.total
+        elapsed = self._elapsed(mono)
         if elapsed >= total:
             return (total, total, None, 0, 0, None)
-        acc = 0
-        for i, ph in enumerate(phases):
-            dur = ph["dur_s"]
-            if elapsed < acc + dur:
-                phase_elapsed = elapsed - acc
-                phase_remaining = (acc + dur) - elapsed
-                return (elapsed, total, i, phase_elapsed, phase_remaining, ph)
-            acc += dur
-        return (total, total, None, 0, 0, None)
+        # primera fase cuyo fin supera elapsed (las de dur 0 se saltan igual que antes)
+        i = bisect_right(prefix, elapsed)
+        acc = prefix[i - 1] if i else 0
+        return (elapsed, total, i, elapsed - acc, prefix[i] - elapsed, phases.phase(i))
 
     # --- calendario semanal / one-off (día) ---
     def _oneoff_for_day(self, ymd: str) -> Optional[str]:
-        with _connect() as con:
-            row = con.execute("SELECT class_id FROM one_off_schedule WHERE ymd=?", (ymd,)).fetchone()
-            return row["class_id"] if row else None
-
-    def _maybe_autostart_by_calendar(self):
+        # memo del último día consultado; add/delete_oneoff lo vacían
+        memo_ymd, cid = self._oneoff_memo
+        if memo_ymd == ymd:
+            return cid
+        with _reader() as con:
+            row = con.execute(_SQL_ONEOFF_BY_DAY, (ymd,)).fetchone()
+        cid = row["class_id"] if row else None
+        self._oneoff_memo = (ymd, cid)
+        return cid
+
+    def _tick_fields(self, now: float) -> Tuple[int, str, str]:
+        """(dow, 'YYYY-MM-DD', 'HH:MM') locales de now; se recalcula una vez por minuto."""
+        minute = int(now // 60)
+        t = self._tick
+        if t[0] != minute:
+            tm = time.localtime(now)
+            t = self._tick = (minute, (
+                tm.tm_wday,  # 0 lunes .. 6 domingo
+                f"{tm.tm_year:04d}-{tm.tm_mon:02d}-{tm.tm_mday:02d}",
+                f"{tm.tm_hour:02d}:{tm.tm_min:02d}",
+            ))
+        return t[1]
+
+    def _maybe_autostart_by_calendar(self, now: Optional[float] = None):
         """
         Disparo por calendario semanal (no preemptivo):
           - Si coincide HH:MM y no se ha consumido hoy:
@@ -309,69 +618,71 @@ class SessionManager:
               * si SÍ hay sesión activa => NO interrumpir, solo registrar consumo de hoy
         Nota: schedule_log garantiza 1 consumo por (sched_id, ymd).
         """
-        now = self._now()
-        now_tm = time.localtime(now)
-        dow = now_tm.tm_wday  # 0 lunes .. 6 domingo
-        ymd = f"{now_tm.tm_year:04d}-{now_tm.tm_mon:02d}-{now_tm.tm_mday:02d}"
-        hhmm = f"{now_tm.tm_hour:02d}:{now_tm.tm_min:02d}"
-
-        with _connect() as con:
-            cur = con.cursor()
-            cur.execute("SELECT sched_id FROM weekly_schedule WHERE dow=? AND time_str=?", (dow, hhmm))
-            rows = cur.fetchall()
-            if not rows:
-                return
+        if now is None:
+            now = self._now()
+        dow, ymd, hhmm = self._tick_fields(now)
 
-            for r in rows:
-                sched_id = r["sched_id"]
-                # ¿ya consumido hoy?
-                cur.execute("SELECT 1 FROM schedule_log WHERE sched_id=? AND ymd=?", (sched_id, ymd))
-                if cur.fetchone():
-                    continue
+        # casi siempre no toca nada este minuto: se resuelve en memoria sin DB
+        sched_ids = _weekly_by_minute().get((dow, hhmm))
+        if not sched_ids:
+            return
+        if self._consumed_ymd != ymd:
+            self._consumed_ymd = ymd
+            self._consumed_today = set()
 
-                # Clase planificada para el día (one-off > default)
-                cls = self._oneoff_for_day(ymd) or get_default_class_id()
+        if self._consumed_today.issuperset(sched_ids):
+            return
 
+        with _writer() as con:
+            pending = [r["sched_id"] for r in con.execute(_SQL_WEEKLY_PENDING, (ymd, dow, hhmm))
+                       if r["sched_id"] not in self._consumed_today]
+            if pending:
                 if (not self.active) and (self.scheduled_ts is None):
-                    # libre: arrancar por calendario
-                    self.start(cls)
-                # Siempre registrar consumo del disparo semanal de hoy
-                cur.execute(
-                    "INSERT OR REPLACE INTO schedule_log(sched_id, ymd, last_start_ts) VALUES(?,?,?)",
-                    (sched_id, ymd, now))
+                    # libre: arrancar por calendario la clase del día (one-off > default)
+                    self.start(self._oneoff_for_day(ymd) or self._get_default_cached())
+                # Siempre registrar consumo de los disparos semanales de hoy
+                con.executemany(_SQL_LOG_UPSERT, [(sid, ymd, now) for sid in pending])
                 con.commit()
-            return
+            # consumidos (ahora o antes, según schedule_log): no volver a consultar hoy
+            self._consumed_today.update(sched_ids)
 
-    def _maybe_autostart(self):
+    def _maybe_autostart(self, now: Optional[float] = None):
+        if now is None:
+            now = self._now()
         # Programación manual puntual (si llega su hora)
-        if self.scheduled_ts is not None and self._now() >= self.scheduled_ts:
+        if self.scheduled_ts is not None and now >= self.scheduled_ts:
             if not self.active:
                 # arrancar manual
                 self.active = True
                 self.start_ts = self._now()
-                self.phases = get_phases(self.class_id or get_default_class_id())
+                self._start_mono = self._mono()
+                self._phases = _get_phases_cached(self.class_id or self._get_default_cached())
                 self.paused = False
                 self.pause_ts = None
+                self._pause_mono = None
                 self.pause_accum = 0
             # Si hay una sesión activa, no se arranca (queda pendiente hasta que termines)
             return
 
         # Calendario semanal (no preemptivo; consume si coincide)
-        self._maybe_autostart_by_calendar()
+        self._maybe_autostart_by_calendar(now)
 
     # -------- API Pública ----------
     def start(self, class_id: str = "moov"):
         """Inicio inmediato (manual). Interrumpe cualquier countdown manual y reemplaza lo que hubiera."""
+        self.invalidate_status()
         self.active = True
         self.class_id = class_id
         self.start_ts = self._now()
-        self.phases = get_phases(class_id)
+        self._start_mono = self._mono()
+        self._phases = _get_phases_cached(class_id)
         self.scheduled_ts = None  # limpia programación puntual
         self.lead_s = 0
         self.paused = False
         self.pause_ts = None
+        self._pause_mono = None
         self.pause_accum = 0
-        if not self.phases:
+        if not self._phases.durs:
             raise ValueError(f"Clase desconocida o sin fases: {class_id}")
 
     def stop(self):
@@ -381,17 +692,21 @@ class SessionManager:
         """Programa manual puntual (no recurrente) con countdown configurable."""
         if start_epoch <= self._now():
             raise ValueError("La hora debe ser futura")
+        self.invalidate_status()
         self.class_id = class_id
         self.scheduled_ts = float(start_epoch)
         self.lead_s = max(0, int(lead_s))
         self.active = False
         self.start_ts = None
-        self.phases = []
+        self._start_mono = None
+        self._phases = _EMPTY_PHASES
         self.paused = False
         self.pause_ts = None
+        self._pause_mono = None
         self.pause_accum = 0
 
     def unschedule(self):
+        self.invalidate_status()
         self.scheduled_ts = None
         self.lead_s = 0
 
@@ -399,42 +714,52 @@ class SessionManager:
     def toggle_pause(self):
         if not self.active:
             return
+        self.invalidate_status()
         if self.paused:
-            if self.pause_ts is not None:
-                self.pause_accum += int(self._now() - self.pause_ts)
+            if self._pause_mono is not None:
+                self.pause_accum += int(self._mono() - self._pause_mono)
             self.paused = False
             self.pause_ts = None
+            self._pause_mono = None
         else:
             self.paused = True
             self.pause_ts = self._now()
+            self._pause_mono = self._mono()
 
     def next_phase(self):
-        if not self.active or not self.phases:
+        if not self.active or not self._phases.durs:
             return
-        now = self._now()
-        elapsed, total, idx, *_ = self._progress(self.phases, self.start_ts, now)
+        now, mono = self._now(), self._mono()
+        elapsed, total, idx, *_ = self._progress(self._phases, self.start_ts, mono)
         if idx is None:
             return
-        acc_before_next = sum(p["dur_s"] for p in self.phases[: idx + 1])
+        acc_before_next = self._phases.prefix[idx]
         self.start_ts = now - acc_before_next
+        self._start_mono = mono - acc_before_next
         self.pause_accum = 0
         if self.paused:
             self.pause_ts = now
+            self._pause_mono = mono
+        self.invalidate_status()
 
     def prev_phase(self):
-        if not self.active or not self.phases:
+        if not self.active or not self._phases.durs:
             return
-        now = self._now()
-        elapsed, total, idx, phase_elapsed, *_ = self._progress(self.phases, self.start_ts, now)
+        now, mono = self._now(), self._mono()
+        elapsed, total, idx, phase_elapsed, *_ = self._progress(self._phases, self.start_ts, mono)
         if idx is None:
             return
-        acc_before_current = sum(p["dur_s"] for p in self.phases[: idx])
+        prefix = self._phases.prefix
         if phase_elapsed < 2 and idx > 0:
-            acc_before_current = sum(p["dur_s"] for p in self.phases[: idx - 1])
+            idx -= 1  # casi al inicio: retrocede a la fase anterior
+        acc_before_current = prefix[idx - 1] if idx else 0
         self.start_ts = now - acc_before_current
+        self._start_mono = mono - acc_before_current
         self.pause_accum = 0
         if self.paused:
             self.pause_ts = now
+            self._pause_mono = mono
+        self.invalidate_status()
 
     def status(self) -> dict:
         """
@@ -442,87 +767,128 @@ class SessionManager:
         - Cuenta atrás:
             * Manual puntual: según self.lead_s.
             * Semanal: 5 minutos antes del siguiente horario (WEEKLY_LEAD_S), solo si no hay otra pending manual.
+        Se sondea varias veces por segundo: dentro del mismo segundo y sin cambios
+        de estado se reutiliza la última respuesta (copia, con 'now' actualizado).
         """
-        self._maybe_autostart()
         now = self._now()
-        resp = {
-            "active": self.active,
-            "class_id": self.class_id,
-            "scheduled_ts": self.scheduled_ts,
-            "lead_s": self.lead_s,
-            "now": now,
-            "paused": self.paused,
-            "default_class_id": get_default_class_id(),
-        }
+        c = self._status_cache
+        if c is not None and c[0] == (int(now), self.active, self.paused, self.class_id, self.scheduled_ts):
+            resp = dict(c[1])
+            resp["now"] = now
+            return resp
+        resp = self._build_status(now)
+        # clave con el estado final (autostart / fin de sesión pueden cambiarlo)
+        self._status_cache = ((int(now), self.active, self.paused, self.class_id, self.scheduled_ts), resp)
+        return dict(resp)
+
+    def _build_status(self, now: float) -> dict:
+        # un solo 'now' por sondeo para autostart, cuentas atrás y respuesta.
+        # Cada rama devuelve su dict completo en un solo literal (mismo orden de claves).
+        self._maybe_autostart(now)
+        active, class_id, scheduled_ts = self.active, self.class_id, self.scheduled_ts
+        default_cid = self._get_default_cached()
 
         # ====== COUNTDOWN PARA PROGRAMACIÓN MANUAL ======
-        if not self.active and self.scheduled_ts is not None:
-            delta = int(self.scheduled_ts - now)
-            resp["countdown_s"] = max(0, delta)
-            resp["show_countdown"] = (delta <= self.lead_s)
-            resp["total_dur_s"] = self._total_dur(get_phases(self.class_id or get_default_class_id()))
-            return resp
+        if not active and scheduled_ts is not None:
+            delta = int(scheduled_ts - now)
+            return {
+                "active": active, "class_id": class_id, "scheduled_ts": scheduled_ts,
+                "lead_s": self.lead_s, "now": now, "paused": self.paused,
+                "default_class_id": default_cid,
+                "countdown_s": max(0, delta),
+                "show_countdown": (delta <= self.lead_s),
+                "total_dur_s": _get_phases_cached(class_id or default_cid).total,
+            }
 
         # ====== COUNTDOWN PARA CALENDARIO SEMANAL ======
-        if not self.active and self.scheduled_ts is None:
+        if not active:
             nxt = _next_weekly_occurrence(now)
             if nxt:
                 sched_id, epoch = nxt
                 delta = int(epoch - now)
                 if 0 <= delta <= WEEKLY_LEAD_S:
-                    import time as _t
-                    ymd = f"{_t.localtime(epoch).tm_year:04d}-{_t.localtime(epoch).tm_mon:02d}-{_t.localtime(epoch).tm_mday:02d}"
-                    planned_class = self._oneoff_for_day(ymd) or get_default_class_id()
-                    resp.update({
+                    tm_e = time.localtime(epoch)
+                    ymd = f"{tm_e.tm_year:04d}-{tm_e.tm_mon:02d}-{tm_e.tm_mday:02d}"
+                    planned_class = self._oneoff_for_day(ymd) or default_cid
+                    return {
+                        "active": active, "class_id": class_id, "scheduled_ts": int(epoch),
+                        "lead_s": self.lead_s, "now": now, "paused": self.paused,
+                        "default_class_id": default_cid,
                         "show_countdown": True,
                         "countdown_s": delta,
                         "next_class_id": planned_class,
-                        "scheduled_ts": int(epoch),
-                        "total_dur_s": self._total_dur(get_phases(planned_class)),
-                    })
-                    return resp
+                        "total_dur_s": _get_phases_cached(planned_class).total,
+                    }
+
+            # Estado inactivo sin countdown: buen momento para vaciar el WAL
+            self._maybe_checkpoint()
+            return {
+                "active": active, "class_id": class_id, "scheduled_ts": scheduled_ts,
+                "lead_s": self.lead_s, "now": now, "paused": self.paused,
+                "default_class_id": default_cid,
+            }
 
         # ====== SESIÓN ACTIVA ======
-        if self.active:
-            phases = self.phases or get_phases(self.class_id or get_default_class_id())
-            elapsed, total, idx, phase_elapsed, phase_rem, phase = self._progress(phases, self.start_ts, now)
-            if idx is None:
-                self.stop()
-                resp.update({"active": False, "finished": True})
-            else:
-                resp.update({
-                    "elapsed_s": elapsed,
-                    "total_s": total,
-                    "phase_idx": idx,
-                    "phase_key": phase["key"],
-                    "phase_remaining_s": phase_rem,
-                    "phase_elapsed_s": phase_elapsed,
-                    "phase_color": phase["color"],
-                })
-            return resp
+        phases = self._phases if self._phases.durs else _get_phases_cached(class_id or default_cid)
+        elapsed, total, idx, phase_elapsed, phase_rem, phase = self._progress(phases, self.start_ts)
+        if idx is None:
+            lead_s, paused = self.lead_s, self.paused
+            self.stop()
+            return {
+                "active": False, "class_id": class_id, "scheduled_ts": scheduled_ts,
+                "lead_s": lead_s, "now": now, "paused": paused,
+                "default_class_id": default_cid,
+                "finished": True,
+            }
+        return {
+            "active": active, "class_id": class_id, "scheduled_ts": scheduled_ts,
+            "lead_s": self.lead_s, "now": now, "paused": self.paused,
+            "default_class_id": default_cid,
+            "elapsed_s": elapsed,
+            "total_s": total,
+            "phase_idx": idx,
+            "phase_key": phase["key"],
+            "phase_remaining_s": phase_rem,
+            "phase_elapsed_s": phase_elapsed,
+            "phase_color": phase["color"],
+        }
 
-        # Estado inactivo sin countdown
-        return resp
+    def _maybe_checkpoint(self):
+        """Checkpoint del WAL en reposo, fuera del camino de las escrituras."""
+        mono = self._mono()
+        if mono - self._last_ckpt_mono < WAL_CHECKPOINT_IDLE_S:
+            return
+        self._last_ckpt_mono = mono
+        with _writer() as con:
+            con.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
 
     # ------- Calendario semanal -------
     def list_schedule(self) -> List[Dict[str, Any]]:
-        with _connect() as con:
+        with _reader() as con:
             cur = con.cursor()
-            cur.execute("SELECT sched_id,dow,time_str FROM weekly_schedule ORDER BY dow,time_str")
+            cur.execute(_SQL_WEEKLY_LIST)
             rows = cur.fetchall()
             return [dict(r) for r in rows]
 
     def add_schedule(self, dow: int, time_str: str) -> int:
-        with _connect() as con:
+        with _writer() as con:
             cur = con.cursor()
-            cur.execute("INSERT INTO weekly_schedule(dow,time_str) VALUES(?,?)", (dow, time_str))
+            if _HAS_RETURNING:
+                sched_id = cur.execute(
+                    "INSERT INTO weekly_schedule(dow,time_str) VALUES(?,?) RETURNING sched_id",
+                    (dow, time_str)).fetchone()[0]
+            else:
+                cur.execute("INSERT INTO weekly_schedule(dow,time_str) VALUES(?,?)", (dow, time_str))
+                sched_id = cur.lastrowid
             con.commit()
-            return cur.lastrowid
+            _invalidate_weekly()
+            self.invalidate_status()
+            return sched_id
 
     def update_schedule(self, sched_id: int, time_str: Optional[str] = None, dow: Optional[int] = None):
         if time_str is None and dow is None:
             return
-        with _connect() as con:
+        with _writer() as con:
             if time_str is not None and dow is not None:
                 con.execute("UPDATE weekly_schedule SET time_str=?, dow=? WHERE sched_id=?", (time_str, dow, sched_id))
             elif time_str is not None:
@@ -530,11 +896,15 @@ class SessionManager:
             else:
                 con.execute("UPDATE weekly_schedule SET dow=? WHERE sched_id=?", (dow, sched_id))
             con.commit()
+            _invalidate_weekly()
+            self.invalidate_status()
 
     def delete_schedule(self, sched_id: int):
-        with _connect() as con:
+        with _writer() as con:
             con.execute("DELETE FROM weekly_schedule WHERE sched_id=?", (sched_id,))
             con.commit()
+            _invalidate_weekly()
+            self.invalidate_status()
 
     def replace_schedule(self, items: List[Dict[str, Any]]):
         norm = []
@@ -546,31 +916,57 @@ class SessionManager:
             if 0 <= dow <= 6 and key not in seen:
                 seen.add(key)
                 norm.append({"dow": dow, "time_str": ts})
-        with _connect() as con:
+        with _writer() as con:
+            _begin(con)
             cur = con.cursor()
             cur.execute("DELETE FROM weekly_schedule")
             cur.executemany("INSERT INTO weekly_schedule(dow,time_str) VALUES(?,?)",
                             [(x["dow"], x["time_str"]) for x in sorted(norm, key=lambda a:(a["dow"], a["time_str"]))])
             con.commit()
+            _invalidate_weekly()
+            self.invalidate_status()
 
     # One-off puntual por **día**
     def list_oneoff(self) -> List[Dict[str, Any]]:
-        with _connect() as con:
+        with _reader() as con:
             cur = con.cursor()
-            cur.execute("SELECT ymd,class_id FROM one_off_schedule ORDER BY ymd")
+            cur.execute(_SQL_ONEOFF_LIST)
             return [dict(r) for r in cur.fetchall()]
 
+    # ------- Instantánea para la UI de administración -------
+    def bulk_snapshot(self) -> Dict[str, Any]:
+        """Catálogo + calendario + one-offs + clase por defecto en una sola lectura."""
+        with _reader() as con:
+            con.execute("BEGIN")  # mismo snapshot para las cuatro consultas
+            try:
+                classes = _class_models_from_rows(con.execute(_SQL_CLASSES_JOIN).fetchall())
+                schedule = [dict(r) for r in con.execute(_SQL_WEEKLY_LIST).fetchall()]
+                oneoff = [dict(r) for r in con.execute(_SQL_ONEOFF_LIST).fetchall()]
+                row = con.execute(_SQL_DEFAULT_CLASS).fetchone()
+            finally:
+                con.rollback()
+        return {
+            "classes": classes,
+            "schedule": schedule,
+            "oneoff": oneoff,
+            "default_class_id": row["value"] if row else "moov",
+        }
+
     def add_oneoff(self, ymd: str, class_id: str):
-        with _connect() as con:
+        with _writer() as con:
             con.execute(
                 "INSERT INTO one_off_schedule(ymd,class_id) VALUES(?,?) ON CONFLICT(ymd) DO UPDATE SET class_id=excluded.class_id",
                 (ymd, class_id))
             con.commit()
+            self._oneoff_memo = (None, None)
+            self.invalidate_status()
 
     def delete_oneoff(self, ymd: str):
-        with _connect() as con:
+        with _writer() as con:
             con.execute("DELETE FROM one_off_schedule WHERE ymd=?", (ymd,))
             con.commit()
+            self._oneoff_memo = (None, None)
+            self.invalidate_status()
 
 
 # Instancia global para usar desde el servidor
@@ -0,0 +1,65 @@
+"""
+SessionStore.update_batch frente a update() muestra a muestra:
+mismos totales, misma zona final y dict nuevo en cada llamada.
+"""
+
+import os
+import random
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+
+USERS = [
+    None,
+    {"edad": 30, "peso": 70, "sexo": "F", "hr_rest": 50},
+    {"edad": 50, "hr_max": 180},
+]
+KEYS = ("hr_max", "method", "zone", "kcal", "moov_points")
+
+
+def _iso(ts_ms):
+    return datetime.fromtimestamp(ts_ms / 1000, timezone.utc).isoformat()
+
+
+def _close(a, b):
+    assert a["hr_max"] == b["hr_max"] and a["method"] == b["method"] and a["zone"] == b["zone"]
+    assert abs(a["kcal"] - b["kcal"]) <= 2e-3
+    assert abs(a["moov_points"] - b["moov_points"]) <= 2e-3
+
+
+def test_batch_matches_repeated_update():
+    rnd = random.Random(3)
+    for _ in range(200):
+        user = rnd.choice(USERS)
+        mode = rnd.choice(["mixed", "cardio", "strength"])
+        one, batch = metrics.SessionStore(), metrics.ShardedSessionStore(4)
+        t = 1_700_000_000_000
+        for _ in range(4):
+            samples = []
+            for _ in range(rnd.randint(1, 40)):
+                t += rnd.choice([0, 250, 1000, -300, 1500])  # incluye dt <= 0
+                samples.append((t, rnd.choice([0, 60, 120, 150, 170, 199, 255, 300])))
+            for ts, hr in samples:
+                ra = one.update(5, user, hr, _iso(ts), mode=mode)
+            _close(ra, batch.update_batch(5, user, samples, mode=mode))
+
+
+def test_batch_without_device_or_samples():
+    user = USERS[1]
+    store = metrics.ShardedSessionStore(4)
+    assert store.update_batch(None, user, [(1, 120)]) == store.update(None, user, 120, None)
+
+    empty = store.update_batch(7, user, [])
+    assert set(empty) == set(KEYS)
+    assert empty["zone"] == "Z1" and empty["kcal"] == 0.0 and empty["moov_points"] == 0.0
+
+
+def test_batch_returns_fresh_dict():
+    store = metrics.SessionStore()
+    a = store.update_batch(3, None, [(0, 120), (1000, 130)])
+    b = store.update_batch(3, None, [(2000, 190)])
+    assert a is not b
+    assert a["zone"] != b["zone"]
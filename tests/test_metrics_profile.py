@@ -0,0 +1,56 @@
+"""
+SessionStore.update: el snapshot del perfil se invalida por valor, así que
+editar el dict de usuario in situ se refleja en la siguiente muestra.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+
+
+def _fresh(user, hr, ts, mode="mixed"):
+    return metrics.SessionStore().update(1, dict(user), hr, ts, mode=mode)
+
+
+def test_in_place_edit_reloads_profile():
+    user = {"id": 1, "edad": 40, "peso": 70, "sexo": "M"}
+    store = metrics.SessionStore()
+    store.update(1, user, 150, "2025-01-01T00:00:00Z")
+
+    user["hr_max"] = 160
+    user["hr_rest"] = 60
+    out = store.update(1, user, 150, "2025-01-01T00:00:00Z")
+    ref = _fresh(user, 150, "2025-01-01T00:00:00Z")
+    assert (out["hr_max"], out["method"], out["zone"]) == (ref["hr_max"], ref["method"], ref["zone"])
+    assert out["hr_max"] == 160 and out["method"] == "hrr"
+
+
+def test_in_place_edit_changes_kcal_rate():
+    user = {"id": 1, "edad": 40, "peso": 70, "sexo": "M"}
+    store = metrics.SessionStore()
+    store.update(1, user, 150, "2025-01-01T00:00:00Z")
+    user["sexo"] = "F"
+    user["peso"] = 55
+    store.update(1, user, 150, "2025-01-01T00:01:00Z")
+    out = store.update(1, user, 150, "2025-01-01T00:02:00Z")
+
+    ref = metrics.SessionStore()
+    ref.update(1, dict(user), 150, "2025-01-01T00:00:00Z")
+    ref.update(1, dict(user), 150, "2025-01-01T00:01:00Z")
+    exp = ref.update(1, dict(user), 150, "2025-01-01T00:02:00Z")
+    assert out == exp
+
+
+def test_mode_change_reloads_profile():
+    user = {"id": 1, "edad": 40}
+    store = metrics.SessionStore()
+    store.update(1, user, 150, "2025-01-01T00:00:00Z", mode="cardio")
+    store.update(1, user, 150, "2025-01-01T00:01:00Z", mode="strength")
+
+    ref = metrics.SessionStore()
+    ref.update(1, user, 150, "2025-01-01T00:00:00Z", mode="strength")
+    exp = ref.update(1, user, 150, "2025-01-01T00:01:00Z", mode="strength")
+    assert store.update(1, user, 150, "2025-01-01T00:01:00Z", mode="strength") == exp